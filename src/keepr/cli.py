@@ -1,14 +1,65 @@
 import click
-import tabulate
 import sys
-from pathlib import Path
-import pyperclip
-from keepr import db, security, session
+from keepr import db, session
+from keepr.render import ANSI_RESET, render_grid
 from keepr.config import (COLOR_SENSITIVE_DATA, COLOR_PRIMARY_DATA, COLOR_WARNING, COLOR_ERROR,
                           COLOR_HEADER, COLOR_PROMPT_BOLD, COLOR_PROMPT_LIGHT, COLOR_SUCCESS)
-from keepr.config import DB_DIR_NAME, SECURITY_DIR_NAME, PEK_FILE_NAME
-from keepr.config import COMMANDS_VALID_NO_ARGS
-from keepr.password_generator import password_generator
+from keepr.config import COMMANDS_VALID_NO_ARGS, COMMANDS_WITHOUT_SESSION, HELP_FLAGS
+
+
+# --- PRE-COMPUTED ANSI STYLES ---
+# click.style() wraps text as "<prefix><text><reset>". Table cells are styled with these prefixes
+# directly, instead of calling click.style() once per cell.
+def ansi_prefix(color):
+    """
+    Returns the ANSI escape prefix click.style() would emit for the given color scheme.
+    """
+    return click.style("", **color)[:-len(ANSI_RESET)]
+
+
+ANSI_SENSITIVE_DATA = ansi_prefix(COLOR_SENSITIVE_DATA)
+ANSI_WARNING = ansi_prefix(COLOR_WARNING)
+ANSI_PRIMARY_DATA = ansi_prefix(COLOR_PRIMARY_DATA)
+
+# --- TABLE HEADERS ---
+VIEW_HEADERS = tuple(
+    click.style(header, **COLOR_HEADER)
+    for header in ("SERVICE", "USERNAME", "PASSWORD", "URL", "NOTE", "CREATED AT", "UPDATED AT")
+)
+SUMMARY_HEADERS = tuple(
+    click.style(header, **COLOR_HEADER)
+    for header in ("SERVICE NAME", "URL", "NOTE", "CREATED AT", "UPDATED AT")
+)
+
+# --- PROMPTS ---
+PROMPT_USERNAME = click.style("Enter username/email", **COLOR_PROMPT_BOLD)
+PROMPT_PASSWORD = click.style("Enter password", **COLOR_PROMPT_BOLD)
+PROMPT_URL = click.style("Enter url (optional)", **COLOR_PROMPT_LIGHT)
+PROMPT_NOTE = click.style("Enter note (optional)", **COLOR_PROMPT_LIGHT)
+
+
+def style_summary_rows(rows):
+    """
+    Lazily applies the color scheme to (service_name, url, note, created_at, updated_at) rows,
+    so rows stream from the DB cursor straight into render_grid().
+    """
+    for r in rows:
+        yield [
+            f"{ANSI_SENSITIVE_DATA}{r[0]}{ANSI_RESET}",  # service_name
+            f"{ANSI_WARNING}{r[1]}{ANSI_RESET}",  # url
+            f"{ANSI_WARNING}{r[2]}{ANSI_RESET}",  # note
+            f"{ANSI_PRIMARY_DATA}{r[3]}{ANSI_RESET}",  # created_at
+            f"{ANSI_PRIMARY_DATA}{r[4]}{ANSI_RESET}"  # updated_at
+        ]
+
+
+def is_help_requested():
+    """
+    Returns True if a help flag appears anywhere on the command line.
+    The flag may also be an option's value (e.g. --note -h), so this is only used to hide banners.
+    """
+    return not HELP_FLAGS.isdisjoint(sys.argv)
+
 
 def authenticate_from_session(ctx):
     """
@@ -25,16 +76,15 @@ def authenticate_from_session(ctx):
 
         # --- SUPPRESS MESSAGE LOGIC ---
         subcommand_name = ctx.invoked_subcommand
-        is_help_requested = any(h in sys.argv for h in ['-h', '--help'])
         is_only_subcommand = (len(sys.argv) == 2 and subcommand_name is not None)
 
         # Suppress the message if:
         # 1. Help was explicitly requested (e.g., keepr view -h)
         # 2. The subcommand was run with no args AND that command is NOT in the valid no-arg list.
         #    (e.g., 'keepr add' is suppressed, but 'keepr list' is NOT suppressed)
+        # The key management commands never reach this point (see cli()).
         should_suppress = (
-                is_help_requested or
-                (subcommand_name in ['login', 'logout']) or
+                is_help_requested() or
                 (is_only_subcommand and subcommand_name not in COMMANDS_VALID_NO_ARGS)
         )
 
@@ -57,17 +107,22 @@ def cli(ctx):
 
     Manages passwords and sensitive data locally using an encrypted SQLite vault.
     """
+    # 'login', 'change-master' and 'rekey' derive their own key and 'logout' only removes the session file,
+    # so skip reading the session and opening the DB for them.
+    if ctx.invoked_subcommand in COMMANDS_WITHOUT_SESSION:
+        ctx.ensure_object(dict)
+        ctx.obj['pek'] = None
+        return
+
     # Try to unlock the vault from the session file
     if not authenticate_from_session(ctx=ctx):
         # Set a flag indicating the vault is locked
         ctx.ensure_object(dict)
         ctx.obj['pek'] = None
 
-        if ctx.invoked_subcommand not in ['login', 'logout', None]:
-            # Check if help was explicitly requested. If so, suppress the lock warning.
-            is_help_requested = any(h in sys.argv for h in ['-h', '--help'])
-            if not is_help_requested:
-                click.secho("Vault is LOCKED. Run 'keepr login' to unlock it.", **COLOR_ERROR)
+        # Suppress the lock warning if help was explicitly requested
+        if ctx.invoked_subcommand is not None and not is_help_requested():
+            click.secho("Vault is LOCKED. Run 'keepr login' to unlock it.", **COLOR_ERROR)
 
 
 @cli.command(help="Logs in and unlocks your vault (creates or renews your session). Each session lasts 1 hour.")
@@ -75,23 +130,30 @@ def login():
     """
     Prompts for the master password, decrypts the PEK, and stores it in a session file.
     """
+    from keepr import security
     # --- SECURITY/KEY RETRIEVAL LOGIC ---
     db.get_db_path()
     security.initialise_security_dir()
     security.generate_salt_file()
+
+    is_first_setup = not security.PEK_FILE.exists()
+
     salt = security.retrieve_salt()
-    kdf = security.key_derivation_function(salt=salt)
     master_password = security.login()
-    kek = security.generate_derived_key(kdf=kdf, master_password=master_password)
 
-    home_dir = Path.home()
-    security_dir = home_dir / DB_DIR_NAME / SECURITY_DIR_NAME
-    pek_file = security_dir / PEK_FILE_NAME
+    # New vaults calibrate the configured KDF; existing vaults use the KDF their PEK was wrapped with
+    if is_first_setup:
+        click.secho("Calibrating key derivation for this machine...", **COLOR_WARNING)
+        kdf_params = security.calibrate_kdf_params()
+    else:
+        kdf_params = security.retrieve_kdf_params()
+    kdf = security.key_derivation_function(salt=salt, params=kdf_params)
+    kek = security.generate_derived_key(kdf=kdf, master_password=master_password)
 
-    if not pek_file.exists():
+    if is_first_setup:
         # First time setup
         pek = security.generate_pek()
-        session_pek = security.encrypt_pek(derived_key=kek, pek=pek)
+        session_pek = security.encrypt_pek(derived_key=kek, pek=pek, kdf_params=kdf_params)
     else:
         # Subsequent login
         session_pek = security.retrieve_and_decrypt_pek(derived_key=kek)
@@ -125,24 +187,32 @@ def change_master_password():
     """
     Changes the master password for the user.
     """
-    # 1. Derive the KEK from the current master password
+    from keepr import security
+    # 1. Unlock the PEK with the current master password
     salt = security.retrieve_salt()
-    kdf = security.key_derivation_function(salt=salt)
-    master_password = security.login()
-    kek = security.generate_derived_key(kdf=kdf, master_password=master_password)
+    _, pek = security.unlock_pek(salt=salt)
 
-    # 2. Retrieve and decrypt the PEK
-    pek = security.retrieve_and_decrypt_pek(derived_key=kek)
-
-    # 3. Prompt user for a new master password
+    # 2. Prompt user for a new master password
     new_master_password = security.prompt_new_master_password()
 
-    # 4. Create a new KEK from the new password
-    kdf = security.key_derivation_function(salt=salt)
-    new_kek = security.generate_derived_key(kdf=kdf, master_password=new_master_password)
+    # 3. Re-encrypt the PEK with a KEK derived from the new password, using the configured KDF (upgrades older vaults)
+    security.rewrap_pek(salt=salt, master_password=new_master_password, pek=pek)
+    click.secho("Successfully updated master password!", **COLOR_SUCCESS)
+
+
+@cli.command(help="Re-calibrates how long unlocking takes to suit this machine. Keeps your Master Password.")
+def rekey():
+    """
+    Re-wraps the PEK with a KEK derived from the same master password using freshly calibrated KDF parameters.
+    """
+    from keepr import security
+    # 1. Unlock the PEK with the current master password
+    salt = security.retrieve_salt()
+    master_password, pek = security.unlock_pek(salt=salt)
 
-    # 5. Re-encrypt pek with new KEK and write pek to disk
-    security.encrypt_pek(derived_key=new_kek, pek=pek)
+    # 2. Re-encrypt the PEK with a KEK derived from the same password using freshly calibrated KDF parameters
+    security.rewrap_pek(salt=salt, master_password=master_password, pek=pek)
+    click.secho("Key derivation re-calibrated successfully.", **COLOR_SUCCESS)
 
 
 @cli.command(
@@ -158,11 +228,30 @@ def change_master_password():
       # Generate password option without special chars:
       $ keepr update github -g -w
       \b
+      # Supply fields as options - only the remaining fields are prompted for:
+      $ keepr add github -g -u me@example.com --url https://github.com --note "work account"
+      \b
     NOTE: Using -g will automatically generate a cryptographically strong password.
     \b
     """
 )
 @click.argument("service_name", type=str)
+@click.option(
+    "-u",
+    "--username",
+    type=str,
+    help="The username/email for the entry. Prompted for if not given.",
+)
+@click.option(
+    "--url",
+    type=str,
+    help="The url for the entry. Prompted for if not given.",
+)
+@click.option(
+    "--note",
+    type=str,
+    help="A note for the entry. Prompted for if not given.",
+)
 @click.option(
     "-g",
     "--generate",
@@ -177,10 +266,10 @@ def change_master_password():
     help="Specify if the password should be generated without special characters. Only works with the -g option.",
 )
 @click.pass_context
-def add(ctx, service_name, generate, without_special_chars):
+def add(ctx, service_name, username, url, note, generate, without_special_chars):
     """
     Creates a new entry in the database.
-    Prompts user for username/email, password, url and note.
+    Prompts user for username/email, password, url and note, unless they were passed as options.
     Prompts user to confirm the new entry and save it into database.
     """
     session_pek = ctx.obj["pek"]
@@ -192,37 +281,44 @@ def add(ctx, service_name, generate, without_special_chars):
         click.secho(f"An entry for '{service_name}' already exists. Please use a different name.", **COLOR_WARNING)
         sys.exit(0)
 
-    username = click.prompt(click.style("Enter username/email", **COLOR_PROMPT_BOLD), type=str)
+    if username is None:
+        username = click.prompt(PROMPT_USERNAME, type=str)
 
     if generate:
+        from keepr.password_generator import password_generator
         password = password_generator(without_special_chars=without_special_chars)
         click.secho(f"Generated password for '{service_name}': {password}", **COLOR_SUCCESS)
     else:
         password = click.prompt(
-            click.style("Enter password", **COLOR_PROMPT_BOLD),
+            PROMPT_PASSWORD,
             hide_input=True,
             confirmation_prompt=True
         )
 
-    url = click.prompt(
-        click.style("Enter url (optional)", **COLOR_PROMPT_LIGHT),
-        type=str,
-        default="null",
-        show_default=False
-    )
+    if url is None:
+        url = click.prompt(
+            PROMPT_URL,
+            type=str,
+            default="null",
+            show_default=False
+        )
 
-    note = click.prompt(
-        click.style("Enter note (optional)", **COLOR_PROMPT_LIGHT),
-        type=str,
-        default="null",
-        show_default=False
-    )
+    if note is None:
+        note = click.prompt(
+            PROMPT_NOTE,
+            type=str,
+            default="null",
+            show_default=False
+        )
 
     if click.confirm(click.style(f"Ready to securely save the entry for '{service_name}'?", **COLOR_PROMPT_LIGHT)):
         try:
-            db.add_entry(pek=session_pek, service_name=service_name, username=username,
-                         password=password, url=url, note=note)
-            click.secho(f"Entry for '{service_name}' saved successfully.", **COLOR_SUCCESS)
+            if db.add_entry(pek=session_pek, service_name=service_name, username=username,
+                            password=password, url=url, note=note):
+                click.secho(f"Entry for '{service_name}' saved successfully.", **COLOR_SUCCESS)
+            else:
+                click.secho(f"An entry for '{service_name}' already exists. Please use a different name.",
+                            **COLOR_WARNING)
         except Exception as e:
             click.secho(f"DB ERROR: {e}", **COLOR_ERROR)
             click.Abort()
@@ -237,14 +333,23 @@ def add(ctx, service_name, generate, without_special_chars):
     EXAMPLE:
       $ keepr view github 
       \b
+      # Copy the password to the clipboard without displaying the entry:
+      $ keepr view github -p
+      \b
       NOTE: This command displays the raw username and password. The information should be copied 
       and the terminal screen cleared immediately for security.
       \b
     """,
 )
 @click.argument("service_name", type=str)
+@click.option(
+    "-p",
+    "--password-only",
+    is_flag=True,
+    help="Only copy the password to the clipboard, without retrieving or displaying the rest of the entry.",
+)
 @click.pass_context
-def view(ctx, service_name):
+def view(ctx, service_name, password_only):
     """
     Retrieve an entry with sensitive info from the database.
     Display the entry in a beautiful table.
@@ -253,40 +358,44 @@ def view(ctx, service_name):
     if not session_pek:
         sys.exit(1)
 
+    # Imported here rather than at module level to keep start-up fast for every other command
+    import pyperclip
+    from keepr import clipboard
+
     try:
         click.secho(f"Retrieving credentials for: {service_name}", **COLOR_HEADER)
-        row = db.view_entry(pek=session_pek, service_name=service_name)
-
-        headers = [
-            click.style("SERVICE", **COLOR_HEADER),
-            click.style("USERNAME", **COLOR_HEADER),
-            click.style("PASSWORD", **COLOR_HEADER),
-            click.style("URL", **COLOR_HEADER),
-            click.style("NOTE", **COLOR_HEADER),
-            click.style("CREATED AT", **COLOR_HEADER),
-            click.style("UPDATED AT", **COLOR_HEADER),
-        ]
 
-        styled_row = []
-        for r in row:
-            styled_row.append([
-                click.style(r[0], **COLOR_SENSITIVE_DATA), # service_name
-                click.style(r[1], **COLOR_SENSITIVE_DATA),  # username
-                click.style(r[2], **COLOR_SENSITIVE_DATA),  # password
-                click.style(r[3], **COLOR_WARNING),  # url
-                click.style(r[4], **COLOR_WARNING),  # note
-                click.style(r[5], **COLOR_PRIMARY_DATA),  # created_at
-                click.style(r[6], **COLOR_PRIMARY_DATA)  # updated_at
-            ])
-
-        display_table = tabulate.tabulate(
-            styled_row,
-            headers=headers,
-            tablefmt="rounded_grid",
-        )
-        click.secho(display_table)
+        if password_only:
+            clipboard.copy(db.view_password(pek=session_pek, service_name=service_name))
+            click.secho(f"The password for '{service_name}' has been copied to your clipboard!", **COLOR_SUCCESS)
+            return
+
+        r = db.view_entry(pek=session_pek, service_name=service_name)
+
+        # Copy while the table is rendered; the result is collected before reporting success
+        clipboard_copy = clipboard.copy_in_background(r[2])
 
-        pyperclip.copy(row[0][2])
+        styled_row = [
+            f"{ANSI_SENSITIVE_DATA}{r[0]}{ANSI_RESET}",  # service_name
+            f"{ANSI_SENSITIVE_DATA}{r[1]}{ANSI_RESET}",  # username
+            f"{ANSI_SENSITIVE_DATA}{r[2]}{ANSI_RESET}",  # password
+            f"{ANSI_WARNING}{r[3]}{ANSI_RESET}",  # url
+            f"{ANSI_WARNING}{r[4]}{ANSI_RESET}",  # note
+            f"{ANSI_PRIMARY_DATA}{r[5]}{ANSI_RESET}",  # created_at
+            f"{ANSI_PRIMARY_DATA}{r[6]}{ANSI_RESET}"  # updated_at
+        ]
+
+        try:
+            display_table = render_grid([styled_row], headers=VIEW_HEADERS)
+            click.echo(display_table)
+        except Exception:
+            # Report a failed copy before the rendering error, so it is never silently dropped
+            copy_error = clipboard_copy.exception()
+            if copy_error is not None:
+                click.secho(f"ERROR: {copy_error}", **COLOR_ERROR)
+            raise
+
+        clipboard_copy.result()
         click.secho(f"The password for '{service_name}' has been copied to your clipboard!", **COLOR_SUCCESS)
         click.secho("\nSECURITY NOTE: Clear your screen immediately!", **COLOR_ERROR)
 
@@ -308,14 +417,23 @@ def view(ctx, service_name):
       # Find all services containing 'bank'
       $ keepr search bank
       \b
+      # Find only services whose names start with 'aws'
+      $ keepr search aws -s
+      \b
       NOTE: Usernames and passwords are intentionally EXCLUDED. Use 'keepr view <service>' 
       to retrieve sensitive credentials for a specific entry.
       \b
     """,
 )
 @click.argument("search_term", type=str)
+@click.option(
+    "-s",
+    "--starts-with",
+    is_flag=True,
+    help="Only match service names that start with the search term. Faster on large vaults.",
+)
 @click.pass_context
-def search(ctx, search_term):
+def search(ctx, search_term, starts_with):
     """
     Retrieve entries with non-sensitive info matching on a search term from the database.
     Display entries in a beautiful table.
@@ -327,36 +445,15 @@ def search(ctx, search_term):
         sys.exit(1)
 
     try:
+        match_description = "start with" if starts_with else "contain"
         click.secho(
-            f"Retrieving entries with service names that contain the search term: {search_term}",
+            f"Retrieving entries with service names that {match_description} the search term: {search_term}",
             **COLOR_HEADER,
         )
-        rows = db.search(pek=session_pek, search_term=search_term)
-
-        headers = [
-            click.style("SERVICE NAME", **COLOR_HEADER),
-            click.style("URL", **COLOR_HEADER),
-            click.style("NOTE", **COLOR_HEADER),
-            click.style("CREATED AT", **COLOR_HEADER),
-            click.style("UPDATED AT", **COLOR_HEADER),
-        ]
+        rows = db.search(pek=session_pek, search_term=search_term, starts_with=starts_with)
 
-        styled_rows = []
-        for r in rows:
-            styled_rows.append([
-                click.style(r[0], **COLOR_SENSITIVE_DATA),  # service_name
-                click.style(r[1], **COLOR_WARNING),  # url
-                click.style(r[2], **COLOR_WARNING),  # note
-                click.style(r[3], **COLOR_PRIMARY_DATA),  # created_at
-                click.style(r[4], **COLOR_PRIMARY_DATA)  # updated_at
-            ])
-
-        display_table = tabulate.tabulate(
-            styled_rows,
-            headers=headers,
-            tablefmt="rounded_grid",
-        )
-        click.secho(display_table)
+        display_table = render_grid(style_summary_rows(rows), headers=SUMMARY_HEADERS)
+        click.echo(display_table)
     except Exception as e:
         click.secho(f"DB ERROR: {e}", **COLOR_ERROR)
         click.Abort()
@@ -390,30 +487,8 @@ def list_entries(ctx):
         click.secho(f"Retrieving all entries.", **COLOR_HEADER)
         rows = db.list_entries(pek=session_pek)
 
-        headers = [
-            click.style("SERVICE NAME", **COLOR_HEADER),
-            click.style("URL", **COLOR_HEADER),
-            click.style("NOTE", **COLOR_HEADER),
-            click.style("CREATED AT", **COLOR_HEADER),
-            click.style("UPDATED AT", **COLOR_HEADER),
-        ]
-
-        styled_rows = []
-        for r in rows:
-            styled_rows.append([
-                click.style(r[0], **COLOR_SENSITIVE_DATA),  # service_name
-                click.style(r[1], **COLOR_WARNING),  # url
-                click.style(r[2], **COLOR_WARNING),  # note
-                click.style(r[3], **COLOR_PRIMARY_DATA),  # created_at
-                click.style(r[4], **COLOR_PRIMARY_DATA)  # updated_at
-            ])
-
-        display_table = tabulate.tabulate(
-            styled_rows,
-            headers=headers,
-            tablefmt="rounded_grid",
-        )
-        click.secho(display_table)
+        display_table = render_grid(style_summary_rows(rows), headers=SUMMARY_HEADERS)
+        click.echo(display_table)
     except Exception as e:
         click.secho(f"DB ERROR: {e}", **COLOR_ERROR)
         click.Abort()
@@ -467,6 +542,7 @@ def update(ctx, service_name, generate, without_special_chars):
         sys.exit(0)
 
     if generate:
+        from keepr.password_generator import password_generator
         password = password_generator(without_special_chars=without_special_chars)
         click.secho(f"Generated new password for '{service_name}': {password}", **COLOR_SUCCESS)
     else:
@@ -479,8 +555,11 @@ def update(ctx, service_name, generate, without_special_chars):
     if click.confirm(
             click.style(f"Ready to securely save the new password for '{service_name}'?", **COLOR_PROMPT_LIGHT)):
         try:
-            db.update_entry(pek=session_pek, service_name=service_name, password=password)
-            click.secho(f"Password for '{service_name}' saved successfully.", **COLOR_SUCCESS)
+            if db.update_entry(pek=session_pek, service_name=service_name, password=password):
+                click.secho(f"Password for '{service_name}' saved successfully.", **COLOR_SUCCESS)
+            else:
+                click.secho(f"An entry for '{service_name}' doesn't exist. "
+                            f"Please check the service name and try again.", **COLOR_WARNING)
         except Exception as e:
             # DB Error: Red
             click.secho(f"DB ERROR: {e}", **COLOR_ERROR)
@@ -518,12 +597,24 @@ def delete(ctx, service_name):
     if click.confirm(click.style(f"Ready to PERMANENTLY delete the entry for: {service_name}? (This cannot be undone)",
                                  **COLOR_ERROR)):
         try:
-            db.delete_entry(pek=session_pek, service_name=service_name)
-            click.secho(f"{service_name} successfully deleted.", **COLOR_SUCCESS)
+            if db.delete_entry(pek=session_pek, service_name=service_name):
+                click.secho(f"{service_name} successfully deleted.", **COLOR_SUCCESS)
+            else:
+                click.secho(f"An entry for '{service_name}' doesn't exist. "
+                            f"Please check the service name and try again.", **COLOR_WARNING)
         except Exception as e:
             click.secho(f"DB ERROR: {e}", **COLOR_ERROR)
             click.Abort()
     else:
         click.secho("Operation cancelled.", **COLOR_WARNING)
 
-cli(obj={})
+
+def main():
+    """
+    Entry point for the 'keepr' console script and the PyInstaller executable.
+    """
+    cli(obj={})
+
+
+if __name__ == "__main__":
+    main()
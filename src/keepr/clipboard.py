@@ -0,0 +1,88 @@
+from concurrent.futures import Future
+import os
+import shutil
+import subprocess
+import sys
+import threading
+import pyperclip
+
+
+def native_copy_command():
+    """
+    Returns the command line of a clipboard tool the text can be piped to directly, or None.
+    Only used on Linux, where pyperclip would otherwise probe the platform before shelling out to the same tools.
+    """
+    if not sys.platform.startswith("linux"):
+        return None
+    if os.environ.get("WAYLAND_DISPLAY") and shutil.which("wl-copy"):
+        return ["wl-copy"]
+    if os.environ.get("DISPLAY") and shutil.which("xclip"):
+        return ["xclip", "-selection", "clipboard", "-i"]
+    return None
+
+
+def copy(text):
+    """
+    Copy text to the clipboard.
+    The text is piped straight to wl-copy/xclip when available, falling back to pyperclip otherwise.
+
+    Args:
+        text (str): The text to copy
+
+    Raises:
+        pyperclip.PyperclipException: If the text could not be copied.
+    """
+    command = native_copy_command()
+    if command is None:
+        pyperclip.copy(text)
+        return
+
+    try:
+        # Both tools fork a background process that owns the selection until something else takes the clipboard.
+        # That process inherits any output pipes, so they are discarded and only the parent's exit is waited on.
+        process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL,
+                                   stderr=subprocess.DEVNULL, close_fds=True)
+    except OSError:
+        pyperclip.copy(text)
+        return
+
+    try:
+        process.stdin.write(text.encode())
+        process.stdin.close()
+    except BrokenPipeError:
+        # The tool exited before reading the text; its exit status is reported below
+        pass
+    process.wait()
+
+    if process.returncode != 0:
+        raise pyperclip.PyperclipException(
+            f"{command[0]} failed to copy to the clipboard (exit status {process.returncode})"
+        )
+
+
+def copy_in_background(text):
+    """
+    Start copying text to the clipboard on a background thread.
+    Some clipboard backends (e.g. X11 selections) take tens of milliseconds to respond,
+    so the caller can render its output while the copy completes.
+
+    Args:
+        text (str): The text to copy
+
+    Returns:
+        A future whose result() waits for the copy and re-raises any PyperclipException.
+    """
+    future = Future()
+
+    def run():
+        future.set_running_or_notify_cancel()
+        try:
+            copy(text)
+        except BaseException as e:
+            future.set_exception(e)
+        else:
+            future.set_result(None)
+
+    # A daemon thread, unlike a ThreadPoolExecutor worker, never holds up interpreter exit (e.g. after Ctrl-C)
+    threading.Thread(target=run, daemon=True).start()
+    return future
@@ -17,18 +17,49 @@ SECURITY_DIR_NAME = ".security"
 SALT_FILE_NAME = "keepr.salt"
 PEK_FILE_NAME = "keepr.key"
 
+# --- KEY DERIVATION CONFIG ---
+KDF_ALGORITHM = "argon2id"  # KDF for new vaults and changed master passwords: "argon2id" or "pbkdf2"
+KDF_TARGET_MS = 250  # Iterations are calibrated so deriving the KEK takes about this long on the user's machine
+ARGON2_MIN_ITERATIONS = 2
+ARGON2_MEMORY_COST_KIB = 64 * 1024
+ARGON2_LANES = 4
+PBKDF2_MIN_ITERATIONS = 600_000
+
+# --- PEK WRAPPING CONFIG ---
+# The encrypted PEK file is PEK_FORMAT_AESGCM + 2-byte header length + header + 12-byte nonce + AES-256-GCM ciphertext.
+# The header is the JSON-encoded KDF parameters the PEK is wrapped with. Everything before the nonce is passed
+# to AES-GCM as associated data, so the parameters are authenticated and written in the same file as the PEK.
+# Files written before this format are Fernet tokens, which always start with FERNET_TOKEN_PREFIX.
+PEK_FORMAT_AESGCM = b"\x01"
+PEK_HEADER_LENGTH_SIZE = 2
+PEK_NONCE_SIZE = 12
+FERNET_TOKEN_PREFIX = b"gAAAAA"
+
 # --- SESSION CONFIG ---
 SESSION_FILE_NAME = "keepr.session"
 SESSION_TIMEOUT_SECONDS = 3600
 
 # --- COMMAND CONFIG ---
-COMMANDS_VALID_NO_ARGS = ['list', 'login', 'logout', 'help']
+COMMANDS_VALID_NO_ARGS = frozenset(('list', 'login', 'logout', 'help'))
+# Commands that never read the session or open the DB
+COMMANDS_WITHOUT_SESSION = frozenset(('login', 'logout', 'change-master', 'rekey'))
+HELP_FLAGS = frozenset(('-h', '--help'))
 
 # --- PASSWORD GENERATOR CONFIG ---
 PASSWORD_LENGTH = 20
 PASSWORD_SPECIAL_CHARS = "!@#$%^&*"
 
 # --- DB QUERIES ---
+# Applied to every connection right after it is keyed.
+# WAL turns each commit into an append to the log; NORMAL sync only fsyncs the WAL at checkpoints.
+SQL_CONNECTION_PRAGMAS = """
+PRAGMA journal_mode = WAL;
+PRAGMA synchronous = NORMAL;
+PRAGMA temp_store = MEMORY;
+PRAGMA cache_size = -20000;
+PRAGMA busy_timeout = 5000;
+"""
+
 SQL_CREATE_TABLE = """
 CREATE TABLE IF NOT EXISTS entries (
     id INTEGER PRIMARY KEY,
@@ -42,6 +73,53 @@ CREATE TABLE IF NOT EXISTS entries (
     );
 """
 
+# NOCASE matches the case-insensitive LIKE, so anchored patterns ('term%') can seek this index.
+SQL_CREATE_SERVICE_NAME_INDEX = """
+CREATE INDEX IF NOT EXISTS idx_entries_service_name_nocase
+ON entries (service_name COLLATE NOCASE);
+"""
+
+# A trigram full-text index over service names, so substring searches ('%term%') probe an index
+# instead of scanning every entry. It stores no content itself; the triggers keep it in step with 'entries'.
+SQL_CREATE_SERVICE_NAME_FTS = """
+CREATE VIRTUAL TABLE IF NOT EXISTS entries_fts USING fts5(
+    service_name,
+    content = 'entries',
+    content_rowid = 'id',
+    tokenize = 'trigram'
+    );
+
+CREATE TRIGGER IF NOT EXISTS entries_fts_insert AFTER INSERT ON entries BEGIN
+    INSERT INTO entries_fts (rowid, service_name) VALUES (new.id, new.service_name);
+END;
+
+CREATE TRIGGER IF NOT EXISTS entries_fts_delete AFTER DELETE ON entries BEGIN
+    INSERT INTO entries_fts (entries_fts, rowid, service_name) VALUES ('delete', old.id, old.service_name);
+END;
+
+CREATE TRIGGER IF NOT EXISTS entries_fts_update AFTER UPDATE OF service_name ON entries BEGIN
+    INSERT INTO entries_fts (entries_fts, rowid, service_name) VALUES ('delete', old.id, old.service_name);
+    INSERT INTO entries_fts (rowid, service_name) VALUES (new.id, new.service_name);
+END;
+
+INSERT INTO entries_fts (entries_fts) VALUES ('rebuild');
+"""
+
+# Bump SCHEMA_VERSION whenever the schema changes, so existing vaults re-run SQL_INITIALISE_SCHEMA once.
+# Vaults already at SCHEMA_VERSION skip the DDL entirely on start-up.
+SCHEMA_VERSION = 2
+
+SQL_GET_SCHEMA_VERSION = "PRAGMA user_version;"
+
+SQL_INITIALISE_SCHEMA = f"""
+BEGIN;
+{SQL_CREATE_TABLE}
+{SQL_CREATE_SERVICE_NAME_INDEX}
+{SQL_CREATE_SERVICE_NAME_FTS}
+PRAGMA user_version = {SCHEMA_VERSION};
+COMMIT;
+"""
+
 SQL_INSERT_ENTRY = """
 INSERT INTO entries (
     service_name,
@@ -56,7 +134,8 @@ VALUES (
     ?,
     ?,
     ?
-    );
+    )
+ON CONFLICT (service_name) DO NOTHING;
 """
 
 SQL_VIEW_ENTRY = """
@@ -71,6 +150,12 @@ FROM entries
 WHERE service_name = ?
 """
 
+SQL_VIEW_PASSWORD = """
+SELECT password
+FROM entries
+WHERE service_name = ?
+"""
+
 SQL_SEARCH = """
 SELECT service_name,
     url,
@@ -78,7 +163,20 @@ SELECT service_name,
     created_at,
     updated_at
 FROM entries
-WHERE service_name LIKE ?
+WHERE service_name LIKE ? ESCAPE '\\'
+"""
+
+# The trigram index only serves LIKE patterns without an ESCAPE clause,
+# so this is used for search terms that contain no wildcard characters.
+SQL_SEARCH_SUBSTRING = """
+SELECT e.service_name,
+    e.url,
+    e.note,
+    e.created_at,
+    e.updated_at
+FROM entries_fts f
+JOIN entries e ON e.id = f.rowid
+WHERE f.service_name LIKE ?
 """
 
 SQL_LIST = """
@@ -102,8 +200,11 @@ DELETE FROM entries
 WHERE service_name = ?;
 """
 
+# Always returns exactly one row (0 or 1), so every lookup takes the same path through the cursor.
 SQL_VALIDATE_SERVICE_NAME = """
-SELECT service_name
-FROM entries
-WHERE service_name = ?
+SELECT EXISTS (
+    SELECT 1
+    FROM entries
+    WHERE service_name = ?
+    )
 """
\ No newline at end of file
@@ -1,22 +1,30 @@
 import sqlcipher3.dbapi2 as sqlite3
 from pathlib import Path
+import atexit
 import click
 import sys
 from keepr.config import *
 
+# The connection is opened and keyed once per process and shared by every db function.
+# sqlite3 keeps a prepared statement cache per connection (cached_statements, 128 by default),
+# so repeated queries also skip re-parsing.
+_connection = None
+_connection_pek = None
+
+# The database directory, resolved once per process
+DB_DIR = Path.home() / DB_DIR_NAME
+
 
 def get_db_path():
     """
     Returns the cross-platform path to the SQLite database file.
     """
-    home_dir = Path.home()
-    db_dir = home_dir / DB_DIR_NAME
     try:
-        Path.mkdir(db_dir, parents=True, exist_ok=True)
-        return db_dir / DB_FILE_NAME
+        Path.mkdir(DB_DIR, parents=True, exist_ok=True)
+        return DB_DIR / DB_FILE_NAME
     except OSError as e:
         click.secho(
-            f"Critical Error: Failed to create database directory at {db_dir}. Details: {e}",
+            f"Critical Error: Failed to create database directory at {DB_DIR}. Details: {e}",
             err=True,
             **COLOR_ERROR,
         )
@@ -25,15 +33,23 @@ def get_db_path():
 
 def get_db_connection(pek):
     """
-    Creates and returns a connection to the database.
+    Returns the connection to the database, creating it on first use.
+    The same connection is returned for as long as the same PEK is used.
     """
+    global _connection, _connection_pek
+
+    if _connection is not None and _connection_pek == pek:
+        return _connection
+    close_db_connection()
+
     db_path = get_db_path()
 
     try:
-        conn = sqlite3.connect(db_path)
+        # IMMEDIATE takes the write lock when a write begins, rather than upgrading a read lock mid-transaction
+        conn = sqlite3.connect(db_path, isolation_level="IMMEDIATE")
         key_hex = pek.hex()
         conn.execute(f"PRAGMA key = \"x'{key_hex}'\";")
-        return conn
+        conn.executescript(SQL_CONNECTION_PRAGMAS)
     except sqlite3.Error as e:
         click.secho(
             f"Critical Error: Could not connect to the database at {db_path}. Details: {e}",
@@ -42,14 +58,34 @@ def get_db_connection(pek):
         )
         sys.exit(1)
 
+    _connection = conn
+    _connection_pek = pek
+    return conn
+
+
+@atexit.register
+def close_db_connection():
+    """
+    Closes the cached database connection, if one is open.
+    """
+    global _connection, _connection_pek
+
+    if _connection is not None:
+        _connection.close()
+        _connection = None
+        _connection_pek = None
+
 
 def initialise_db(pek):
     """
-    Creates the 'entries' table if it does not already exist.
+    Creates the 'entries' table and its indexes if the vault's schema is out of date.
+    The schema is created in a single transaction and is skipped once the vault is at SCHEMA_VERSION.
     """
     try:
-        with get_db_connection(pek) as conn:
-            conn.execute(SQL_CREATE_TABLE)
+        conn = get_db_connection(pek)
+        schema_version = conn.execute(SQL_GET_SCHEMA_VERSION).fetchone()[0]
+        if schema_version < SCHEMA_VERSION:
+            conn.executescript(SQL_INITIALISE_SCHEMA)
     except sqlite3.Error as e:
         click.secho(f"Could not initialise the database. Details: {e}", err=True, **COLOR_ERROR)
         sys.exit(1)
@@ -58,27 +94,29 @@ def initialise_db(pek):
 def add_entry(pek, service_name, username, password, url, note):
     """
     Insert a new entry into the database.
+
+    Returns:
+        True if the entry was inserted, False if an entry with the service name already exists.
     """
     try:
         with get_db_connection(pek) as conn:
-            conn.execute(
+            cur = conn.execute(
                 SQL_INSERT_ENTRY, (service_name, username, password, url, note)
             )
+            return cur.rowcount == 1
     except sqlite3.Error as e:
         raise Exception(f"Could not insert entry for {service_name}. Details: {e}")
 
 
 def view_entry(pek, service_name):
     """
-    Retrieve information from the db for the requested entry and return a list containing a tuple.
-    The output will be piped into the tabulate() func which requires a list of iterables.
+    Retrieve information from the db for the requested entry and return it as a tuple.
     """
     try:
         with get_db_connection(pek) as conn:
-            cur = conn.cursor()
-            cur.execute(SQL_VIEW_ENTRY, (service_name,))
-            row = cur.fetchmany(1)
-            if len(row) == 0:
+            cur = conn.execute(SQL_VIEW_ENTRY, (service_name,))
+            row = cur.fetchone()
+            if row is None:
                 click.secho(f"No entry was found with the service name: {service_name}", fg="yellow")
                 sys.exit(0)
             return row
@@ -86,25 +124,58 @@ def view_entry(pek, service_name):
         raise Exception(f"Could not retrieve entry for {service_name}. Details: {e}")
 
 
-def search(pek, search_term):
+def view_password(pek, service_name):
     """
-    Retrieve information from the db for any service name that matches to the search term and return a list containing tuples.
-    The output will be piped into the tabulate() func which requires a list of iterables.
+    Retrieve only the password for the requested entry.
+    Used when the password is copied to the clipboard without displaying the entry.
     """
-    search_pattern = f"%{search_term}%"
+    try:
+        with get_db_connection(pek) as conn:
+            cur = conn.execute(SQL_VIEW_PASSWORD, (service_name,))
+            row = cur.fetchone()
+            if row is None:
+                click.secho(f"No entry was found with the service name: {service_name}", fg="yellow")
+                sys.exit(0)
+            return row[0]
+    except sqlite3.Error as e:
+        raise Exception(f"Could not retrieve the password for {service_name}. Details: {e}")
+
+
+def escape_like_pattern(term):
+    """
+    Escape the LIKE wildcards in a user supplied term, so '%' and '_' are matched literally.
+    """
+    return term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def search(pek, search_term, starts_with=False):
+    """
+    Retrieve information from the db for any service name containing (or, with starts_with, starting with) the search term and yield tuples.
+    The output will be piped into the render_grid() func which accepts any iterable of iterables.
+    """
+    escaped_term = escape_like_pattern(search_term)
+    sql = SQL_SEARCH
+    if starts_with:
+        search_pattern = f"{escaped_term}%"
+        match_description = "start with"
+    else:
+        search_pattern = f"%{escaped_term}%"
+        match_description = "contain"
+        if escaped_term == search_term:
+            sql = SQL_SEARCH_SUBSTRING
 
     try:
         with get_db_connection(pek) as conn:
-            cur = conn.cursor()
-            cur.execute(SQL_SEARCH, (search_pattern,))
-            rows = cur.fetchall()
-            if len(rows) == 0:
+            cur = conn.execute(sql, (search_pattern,))
+            first_row = cur.fetchone()
+            if first_row is None:
                 click.secho(
-                    f"No entries were found with service names that contain the search term: {search_term}",
+                    f"No entries were found with service names that {match_description} the search term: {search_term}",
                     fg="yellow",
                 )
                 sys.exit(0)
-            return rows
+            yield first_row
+            yield from cur
     except sqlite3.Error as e:
         raise Exception(
             f"Could not retrieve any entries for {search_term}. Details: {e}"
@@ -113,21 +184,21 @@ def search(pek, search_term):
 
 def list_entries(pek):
     """
-    Retrieve information from the db for all service names and return a list containing tuples.
-    The output will be piped into the tabulate() func which requires a list of iterables.
+    Retrieve information from the db for all service names and yield tuples.
+    The output will be piped into the render_grid() func which accepts any iterable of iterables.
     """
     try:
         with get_db_connection(pek) as conn:
-            cur = conn.cursor()
-            cur.execute(SQL_LIST)
-            rows = cur.fetchall()
-            if len(rows) == 0:
+            cur = conn.execute(SQL_LIST)
+            first_row = cur.fetchone()
+            if first_row is None:
                 click.secho(
                     f"No entries are currently stored. Please add at least one entry",
                     fg="yellow",
                 )
                 sys.exit(0)
-            return rows
+            yield first_row
+            yield from cur
     except sqlite3.Error as e:
         raise Exception(f"Could not retrieve all entries. Details: {e}")
 
@@ -135,16 +206,20 @@ def list_entries(pek):
 def update_entry(pek, service_name, password):
     """
     Update the password for an entry in the database.
+
+    Returns:
+        True if the entry was updated, False if no entry exists with the service name.
     """
     try:
         with get_db_connection(pek) as conn:
-            conn.execute(
+            cur = conn.execute(
                 SQL_UPDATE_ENTRY,
                 (
                     password,
                     service_name,
                 ),
             )
+            return cur.rowcount == 1
     except sqlite3.Error as e:
         raise Exception(f"Could not update the entry for {service_name}. Details: {e}")
 
@@ -152,10 +227,14 @@ def update_entry(pek, service_name, password):
 def delete_entry(pek, service_name):
     """
     Delete an entry from the database.
+
+    Returns:
+        True if the entry was deleted, False if no entry exists with the service name.
     """
     try:
         with get_db_connection(pek) as conn:
-            conn.execute(SQL_DELETE_ENTRY, (service_name,))
+            cur = conn.execute(SQL_DELETE_ENTRY, (service_name,))
+            return cur.rowcount == 1
     except sqlite3.Error as e:
         raise Exception(f"Could not delete the entry for {service_name}. Details: {e}")
 
@@ -163,19 +242,15 @@ def delete_entry(pek, service_name):
 def validate_service_name(pek, service_name):
     """
     Validate that a record exists in the database using the passed service name.
+    The lookup is answered from the service name's UNIQUE index without reading the entry itself.
     """
     try:
         with get_db_connection(pek) as conn:
-            cur = conn.cursor()
-            cur.execute(
+            cur = conn.execute(
                 SQL_VALIDATE_SERVICE_NAME,
                 (service_name,),
             )
-            row = cur.fetchmany(1)
-            if len(row) > 0:
-                return True
-            else:
-                return False
+            return bool(cur.fetchone()[0])
     except sqlite3.Error as e:
         raise Exception(
             f"Could not validate the entry for {service_name}. Details: {e}"
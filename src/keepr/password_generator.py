@@ -2,6 +2,84 @@ import string
 import secrets
 from keepr.config import PASSWORD_LENGTH, PASSWORD_SPECIAL_CHARS
 
+# --- CHARACTER CLASSES ---
+# Each class is a single bit, so a password's classes can be checked with `in` and counted with count()
+LOWER = 1
+UPPER = 2
+SPECIAL = 4
+DIGIT = 8
+
+CLASS_CHARS = {
+    LOWER: string.ascii_lowercase.encode("ascii"),
+    UPPER: string.ascii_uppercase.encode("ascii"),
+    SPECIAL: PASSWORD_SPECIAL_CHARS.encode("ascii"),
+    DIGIT: string.digits.encode("ascii"),
+}
+
+# Minimum number of characters of each class a generated password must contain
+MIN_CLASS_COUNTS = {LOWER: 1, UPPER: 1, SPECIAL: 1, DIGIT: 3}
+
+
+def build_class_table():
+    """
+    Build a bytes.translate() table mapping every ASCII character to its character class bit.
+    Characters outside the password alphabet map to 0.
+    """
+    table = bytearray(256)
+    for char_class, chars in CLASS_CHARS.items():
+        for c in chars:
+            table[c] = char_class
+    return bytes(table)
+
+
+CLASS_TABLE = build_class_table()
+
+
+def random_chars(alphabet, count):
+    """
+    Draw count characters uniformly at random from alphabet using batched secrets.token_bytes() calls.
+    Bytes at or above the largest multiple of len(alphabet) are rejected so every character is equally likely.
+
+    Args:
+        alphabet (bytes): The characters to choose from
+        count (int): The number of characters to draw
+
+    Returns:
+        The random characters (bytes)
+    """
+    size = len(alphabet)
+    cutoff = 256 - (256 % size)
+    chars = bytearray()
+    while len(chars) < count:
+        # Over-draw so a single call almost always covers the rejected bytes
+        chars += bytes(alphabet[b % size] for b in secrets.token_bytes(count * 2) if b < cutoff)
+    return bytes(chars[:count])
+
+
+def patch_password(password, min_counts):
+    """
+    Overwrite random characters of password until it meets the minimum count of every class.
+    Only characters whose class is above its own minimum are overwritten, so fixing one class never breaks another.
+
+    Args:
+        password (bytes): The randomly generated password
+        min_counts (dict): The minimum number of characters required per class
+
+    Returns:
+        The patched password (bytes)
+    """
+    password = bytearray(password)
+    rng = secrets.SystemRandom()
+    for char_class, minimum in min_counts.items():
+        # Classify every character in one C-level pass instead of one Python loop per policy rule
+        classes = password.translate(CLASS_TABLE)
+        while classes.count(char_class) < minimum:
+            spare_positions = [i for i, c in enumerate(classes) if classes.count(c) > min_counts.get(c, 0)]
+            password[rng.choice(spare_positions)] = random_chars(CLASS_CHARS[char_class], 1)[0]
+            classes = password.translate(CLASS_TABLE)
+    return bytes(password)
+
+
 def password_generator(without_special_chars=False):
     """
     Password generator function.
@@ -9,15 +87,12 @@ def password_generator(without_special_chars=False):
     Returns:
         password: cryptographically secure randomly generated password
     """
+    min_counts = dict(MIN_CLASS_COUNTS)
     if without_special_chars:
         alphabet = string.ascii_letters + string.digits
+        del min_counts[SPECIAL]
     else:
         alphabet = string.ascii_letters + string.digits + PASSWORD_SPECIAL_CHARS
-    while True:
-        password = ''.join(secrets.choice(alphabet) for i in range(PASSWORD_LENGTH))
-        if (any(c.islower() for c in password)
-                and any(c.isupper() for c in password)
-                and any(c in password for c in PASSWORD_SPECIAL_CHARS)
-                and sum(c.isdigit() for c in password) >= 3):
-            break
-    return password
+    # Generate once and patch in any missing classes, rather than regenerating until the policy is met
+    password = random_chars(alphabet.encode("ascii"), PASSWORD_LENGTH)
+    return patch_password(password, min_counts).decode("ascii")
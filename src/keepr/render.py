@@ -0,0 +1,79 @@
+import re
+
+# Matches the SGR escape codes produced by click.style(), which take up no space on screen
+ANSI_ESCAPE = re.compile(r"\x1b\[[0-9;]*m")
+# Matches the run of codes a styled cell starts with, e.g. a color followed by bold
+ANSI_STYLE_PREFIX = re.compile(r"(?:\x1b\[[0-9;]*m)+")
+ANSI_RESET = "\x1b[0m"
+
+# Extra width given to every column beyond its header, so headers never sit flush against a border
+HEADER_PADDING = 2
+
+
+def visible_len(text):
+    """
+    Returns the number of characters text takes up on screen, ignoring ANSI escape codes.
+    """
+    return len(ANSI_ESCAPE.sub("", text))
+
+
+def split_cell(cell):
+    """
+    Split a cell into the lines it takes up on screen.
+    If the cell starts with an ANSI style, the style is re-applied on every line and reset at the end of each,
+    so the color does not bleed into the borders drawn between the lines.
+    """
+    lines = cell.split("\n")
+    style = ANSI_STYLE_PREFIX.match(cell)
+    if len(lines) == 1 or style is None:
+        return lines
+
+    prefix = style.group()
+    # The last line already ends with the cell's own reset
+    return [lines[0] + ANSI_RESET] + [prefix + line + ANSI_RESET for line in lines[1:-1]] + [prefix + lines[-1]]
+
+
+def render_grid(rows, headers):
+    """
+    Render rows as a table with rounded box-drawing borders and a line between every row.
+    Cells may contain ANSI color codes, which are excluded when measuring column widths,
+    and newlines, which split the cell over several lines of the row.
+
+    Args:
+        rows: An iterable of rows, each an iterable of cell strings
+        headers: The header cell strings
+
+    Returns:
+        The rendered table (str)
+    """
+    headers = [str(h) for h in headers]
+    widths = [visible_len(h) + HEADER_PADDING for h in headers]
+
+    # Measure every line of every cell once; the lengths are reused when padding the cells below
+    measured_rows = []
+    for row in rows:
+        cells = [[(line, visible_len(line)) for line in split_cell(str(c))] for c in row]
+        widths = [max(w, max(length for _, length in cell)) for w, cell in zip(widths, cells)]
+        measured_rows.append(cells)
+
+    def border(left, middle, right):
+        return left + middle.join("─" * (w + 2) for w in widths) + right
+
+    def data_lines(cells):
+        height = max(len(cell) for cell in cells)
+        for i in range(height):
+            padded = (
+                cell[i][0] + " " * (w - cell[i][1]) if i < len(cell) else " " * w
+                for cell, w in zip(cells, widths)
+            )
+            yield "│ " + " │ ".join(padded) + " │"
+
+    row_separator = border("├", "┼", "┤")
+    lines = [border("╭", "┬", "╮")]
+    lines.extend(data_lines([[(h, visible_len(h))] for h in headers]))
+    for cells in measured_rows:
+        lines.append(row_separator)
+        lines.extend(data_lines(cells))
+    lines.append(border("╰", "┴", "╯"))
+
+    return "\n".join(lines)
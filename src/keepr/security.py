@@ -1,41 +1,47 @@
 import base64
+import json
 import os
+import time
 from pathlib import Path
+from cryptography.exceptions import InvalidTag
 from cryptography.fernet import Fernet, InvalidToken
 from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.argon2 import Argon2id
 from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
 from keepr.config import DB_DIR_NAME, SECURITY_DIR_NAME, SALT_FILE_NAME, PEK_FILE_NAME
+from keepr.config import KDF_ALGORITHM, KDF_TARGET_MS, ARGON2_MIN_ITERATIONS, ARGON2_MEMORY_COST_KIB, ARGON2_LANES
+from keepr.config import PBKDF2_MIN_ITERATIONS
+from keepr.config import PEK_FORMAT_AESGCM, PEK_HEADER_LENGTH_SIZE, PEK_NONCE_SIZE, FERNET_TOKEN_PREFIX
 from keepr.config import COLOR_WARNING, COLOR_ERROR, COLOR_PROMPT_BOLD, COLOR_PROMPT_LIGHT, COLOR_SUCCESS
 import click
 import sys
 
+# Resolved once per process; every command uses the same files
+SECURITY_DIR = Path.home() / DB_DIR_NAME / SECURITY_DIR_NAME
+SALT_FILE = SECURITY_DIR / SALT_FILE_NAME
+PEK_FILE = SECURITY_DIR / PEK_FILE_NAME
+
 
 def initialise_security_dir():
     """
     Initialise the security directory.
     """
-    home_dir = Path.home()
-    security_dir = home_dir / DB_DIR_NAME / SECURITY_DIR_NAME
     try:
-        Path.mkdir(security_dir, parents=True, exist_ok=True)
+        Path.mkdir(SECURITY_DIR, parents=True, exist_ok=True)
     except OSError as e:
-        click.secho(f"Error creating security directory at {security_dir}: {e}", **COLOR_ERROR)
+        click.secho(f"Error creating security directory at {SECURITY_DIR}: {e}", **COLOR_ERROR)
         sys.exit(1)
 
 def generate_salt_file():
     """
     Generate a random salt and write it to a file, if a salt file doesn't exist.
     """
-    home_dir = Path.home()
-    security_dir = home_dir / DB_DIR_NAME / SECURITY_DIR_NAME
-    salt_file = security_dir / SALT_FILE_NAME
-    if not salt_file.exists():
-        salt = os.urandom(16)
+    if not SALT_FILE.exists():
         try:
-            with open(salt_file, "wb") as f:
-                f.write(salt)
+            SALT_FILE.write_bytes(os.urandom(16))
         except IOError as e:
-            click.secho(f"Error writing salt file to {salt_file}: {e}", **COLOR_ERROR)
+            click.secho(f"Error writing salt file to {SALT_FILE}: {e}", **COLOR_ERROR)
             sys.exit(1)
 
 
@@ -46,41 +52,160 @@ def retrieve_salt():
     Returns:
          The salt (bytes) or None on failure.
     """
-    home_dir = Path.home()
-    security_dir = home_dir / DB_DIR_NAME / SECURITY_DIR_NAME
-    salt_file = security_dir / SALT_FILE_NAME
     try:
-        with open(salt_file, "rb") as f:
-            salt = f.read()
+        salt = SALT_FILE.read_bytes()
         if not salt:
-            click.secho(f"Salt file is empty: {salt_file}", **COLOR_ERROR)
+            click.secho(f"Salt file is empty: {SALT_FILE}", **COLOR_ERROR)
             sys.exit(1)
         return salt
     except FileNotFoundError:
-        click.secho(f"Salt file not found at {salt_file}. Run setup first.", **COLOR_ERROR)
+        click.secho(f"Salt file not found at {SALT_FILE}. Run setup first.", **COLOR_ERROR)
         sys.exit(1)
     except IOError as e:
         click.secho(f"Error reading salt file: {e}", **COLOR_ERROR)
         sys.exit(1)
 
 
-def key_derivation_function(salt):
+def default_kdf_params():
+    """
+    Returns the minimum-cost parameters of the configured KDF, before calibration.
+
+    Returns:
+        The KDF parameters (dict)
+    """
+    if KDF_ALGORITHM == "argon2id":
+        return {
+            "algorithm": "argon2id",
+            "iterations": ARGON2_MIN_ITERATIONS,
+            "memory_cost": ARGON2_MEMORY_COST_KIB,
+            "lanes": ARGON2_LANES,
+        }
+    return {"algorithm": "pbkdf2", "iterations": PBKDF2_MIN_ITERATIONS}
+
+
+def calibrate_kdf_params(target_ms=KDF_TARGET_MS):
+    """
+    Pick KDF parameters so that deriving a key takes about target_ms on this machine.
+    Only the iteration count is tuned; the algorithm and memory cost come from default_kdf_params().
+    Starting from the minimum, the iteration count is doubled until a derivation exceeds the target,
+    then scaled down linearly. It never drops below the minimum, so slow machines still get a safe cost.
+
+    Args:
+        target_ms (int): The target derivation time in milliseconds
+
+    Returns:
+        The calibrated KDF parameters (dict)
+    """
+    params = default_kdf_params()
+    min_iterations = params["iterations"]
+    salt = os.urandom(16)
+
+    while True:
+        kdf = key_derivation_function(salt=salt, params=params)
+        start = time.perf_counter()
+        kdf.derive(b"keepr-kdf-calibration")
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        if elapsed_ms >= target_ms:
+            break
+        params["iterations"] *= 2
+
+    params["iterations"] = max(min_iterations, round(params["iterations"] * target_ms / elapsed_ms))
+    return params
+
+
+def read_pek_file():
+    """
+    Read the encrypted PEK file.
+
+    Returns:
+        The contents of the PEK file (bytes) or None on failure.
+    """
+    try:
+        return PEK_FILE.read_bytes()
+    except FileNotFoundError:
+        click.secho(f"PEK file not found at {PEK_FILE}. Run setup first.", **COLOR_ERROR)
+        return None
+    except IOError as e:
+        click.secho(f"Error reading PEK file: {e}", **COLOR_ERROR)
+        return None
+
+
+def parse_aesgcm_pek(encrypted_pek):
+    """
+    Split an AES-GCM PEK file into its parts.
+
+    Args:
+        encrypted_pek (bytes): The contents of the PEK file
+
+    Returns:
+        A tuple of (associated data (bytes), KDF parameters (dict), nonce (bytes), ciphertext (bytes)).
+    """
+    try:
+        header_start = len(PEK_FORMAT_AESGCM) + PEK_HEADER_LENGTH_SIZE
+        header_length = int.from_bytes(encrypted_pek[len(PEK_FORMAT_AESGCM):header_start], "big")
+        nonce_start = header_start + header_length
+        params = json.loads(encrypted_pek[header_start:nonce_start])
+    except ValueError as e:
+        click.secho(f"PEK file is corrupt: {PEK_FILE}. Details: {e}", **COLOR_ERROR)
+        sys.exit(1)
+    ciphertext_start = nonce_start + PEK_NONCE_SIZE
+    return (
+        encrypted_pek[:nonce_start],
+        params,
+        encrypted_pek[nonce_start:ciphertext_start],
+        encrypted_pek[ciphertext_start:],
+    )
+
+
+def retrieve_kdf_params():
+    """
+    Retrieve the KDF parameters the PEK is wrapped with, from the header of the PEK file.
+    PEK files written before the parameters were recorded are Fernet tokens, and use PBKDF2.
+
+    Returns:
+        The KDF parameters (dict)
+    """
+    encrypted_pek = read_pek_file()
+    if encrypted_pek is None:
+        sys.exit(1)
+    if encrypted_pek.startswith(PEK_FORMAT_AESGCM):
+        return parse_aesgcm_pek(encrypted_pek)[1]
+    # The parameters every vault used before they were recorded
+    return {"algorithm": "pbkdf2", "iterations": 1_200_000}
+
+
+def key_derivation_function(salt, params=None):
     """
     Define a key derivation function that uses the salt from the salt file.
 
     Args:
         salt (bytes): The salt from the salt file
+        params (dict): The KDF parameters to use. Defaults to the parameters stored for the vault.
 
     Returns:
         The key derivation function
     """
-    kdf = PBKDF2HMAC(
-        algorithm=hashes.SHA256(),
-        length=32,
-        salt=salt,
-        iterations=1_200_000,
-    )
-    return kdf
+    if params is None:
+        params = retrieve_kdf_params()
+
+    if params["algorithm"] == "argon2id":
+        return Argon2id(
+            salt=salt,
+            length=32,
+            iterations=params["iterations"],
+            lanes=params["lanes"],
+            memory_cost=params["memory_cost"],
+        )
+    if params["algorithm"] == "pbkdf2":
+        return PBKDF2HMAC(
+            algorithm=hashes.SHA256(),
+            length=32,
+            salt=salt,
+            iterations=params["iterations"],
+        )
+
+    click.secho(f"Unsupported key derivation algorithm: {params['algorithm']}", **COLOR_ERROR)
+    sys.exit(1)
 
 
 def login():
@@ -90,11 +215,7 @@ def login():
     Returns:
          The master password (str).
     """
-    home_dir = Path.home()
-    security_dir = home_dir / DB_DIR_NAME / SECURITY_DIR_NAME
-    pek_file = security_dir / PEK_FILE_NAME
-
-    if not pek_file.exists():
+    if not PEK_FILE.exists():
         click.secho("Welcome to Keepr! Initial setup required.", **COLOR_WARNING)
         master_password = click.prompt(
             click.style("Please create your master password", **COLOR_PROMPT_BOLD),
@@ -107,10 +228,10 @@ def login():
             sys.exit(1)
         return master_password
     else:
+        # No confirmation prompt: a mistyped password simply fails to decrypt the PEK
         master_password = click.prompt(
             click.style("Please enter your current master password", **COLOR_PROMPT_BOLD),
             hide_input=True,
-            confirmation_prompt=True,
         )
         return master_password
 
@@ -131,9 +252,7 @@ def prompt_new_master_password():
     if not master_password:
         click.secho("Master password cannot be empty.", **COLOR_ERROR)
         sys.exit(1)
-    if click.confirm(click.style("Ready to save your new master password?", **COLOR_PROMPT_LIGHT)):
-        click.secho("Successfully updated master password!", **COLOR_SUCCESS)
-    else:
+    if not click.confirm(click.style("Ready to save your new master password?", **COLOR_PROMPT_LIGHT)):
         click.secho("Operation cancelled.", **COLOR_WARNING)
         sys.exit(1)
     return master_password
@@ -148,9 +267,9 @@ def generate_derived_key(kdf, master_password):
         master_password: The master password to use
 
     Returns:
-        The derived key (bytes)
+        The raw 32-byte derived key (bytes)
     """
-    key = base64.urlsafe_b64encode(kdf.derive(master_password.encode()))
+    key = kdf.derive(master_password.encode())
     return key
 
 
@@ -162,40 +281,45 @@ def generate_pek():
     return pek
 
 
-def encrypt_pek(derived_key, pek):
+def encrypt_pek(derived_key, pek, kdf_params):
     """
     Takes Primary Encryption Key (PEK) and locks it
-    by encrypting it with the derived key (Key Encryption Key - KEK) using Fernet.
-    Stores the encrypted PEK to disk.
+    by encrypting it with the derived key (Key Encryption Key - KEK) using AES-256-GCM.
+    Stores the encrypted PEK to disk, together with the KDF parameters the KEK was derived with.
+    The file is replaced atomically, so an interrupted write never leaves the PEK and its parameters out of step.
 
     Args:
-        derived_key (bytes): The 44-byte base64url-encoded key from the KDF.
+        derived_key (bytes): The raw 32-byte key from the KDF.
         pek (bytes): The PEK to encrypt
+        kdf_params (dict): The KDF parameters derived_key was derived with
 
     Returns:
         The decrypted PEK (bytes) or None on failure.
     """
-    home_dir = Path.home()
-    security_dir = home_dir / DB_DIR_NAME / SECURITY_DIR_NAME
-    pek_file = security_dir / PEK_FILE_NAME
-
     try:
-        f = Fernet(derived_key)
+        aesgcm = AESGCM(derived_key)
     except ValueError as e:
-        click.secho(f"Internal error: Invalid Fernet key generated: {e}", **COLOR_ERROR)
+        click.secho(f"Internal error: Invalid AES-GCM key generated: {e}", **COLOR_ERROR)
         sys.exit(1)
 
-    # 1. Encrypt the PEK
+    # 1. Encrypt the PEK, authenticating the KDF parameters as associated data
     try:
-        encrypted_pek = f.encrypt(pek)
+        header = json.dumps(kdf_params).encode()
+        associated_data = PEK_FORMAT_AESGCM + len(header).to_bytes(PEK_HEADER_LENGTH_SIZE, "big") + header
+        nonce = os.urandom(PEK_NONCE_SIZE)
+        encrypted_pek = associated_data + nonce + aesgcm.encrypt(nonce, pek, associated_data)
     except Exception as e:
         click.secho(f"Internal error: Failed to encrypt PEK: {e}", **COLOR_ERROR)
         sys.exit(1)
 
-    # 2. Store the Encrypted PEK
+    # 2. Store the Encrypted PEK: write a temporary file, flush it to disk, then swap it into place
+    temp_pek_file = PEK_FILE.with_name(PEK_FILE.name + ".tmp")
     try:
-        with open(pek_file, "wb") as file:
+        with open(temp_pek_file, "wb") as file:
             file.write(encrypted_pek)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_pek_file, PEK_FILE)
     except IOError as e:
         click.secho(f"Critical error: Failed to write PEK file: {e}", **COLOR_ERROR)
         sys.exit(1)
@@ -205,7 +329,8 @@ def encrypt_pek(derived_key, pek):
 
 def retrieve_and_decrypt_pek(derived_key):
     """
-    Retrieve the PEK and decrypt it using Fernet.
+    Retrieve the PEK and decrypt it using AES-256-GCM.
+    PEK files written before AES-GCM was adopted are Fernet tokens, and are decrypted with Fernet instead.
 
     Args:
         derived_key (bytes): The derived key (KEK) to use
@@ -213,35 +338,62 @@ def retrieve_and_decrypt_pek(derived_key):
     Returns:
         The decrypted primary encryption key (PEK) (bytes) or None on failure.
     """
-    home_dir = Path.home()
-    security_dir = home_dir / DB_DIR_NAME / SECURITY_DIR_NAME
-    pek_file = security_dir / PEK_FILE_NAME
-
     # 1. Retrieve the Encrypted PEK
-    try:
-        with open(pek_file, "rb") as file:
-            encrypted_pek = file.read()
-    except FileNotFoundError:
-        click.secho(f"PEK file not found at {pek_file}. Run setup first.", **COLOR_ERROR)
-        return None
-    except IOError as e:
-        click.secho(f"Error reading PEK file: {e}", **COLOR_ERROR)
-        return None
-
-    # 2. Initialize Fernet
-    try:
-        f = Fernet(derived_key)
-    except ValueError as e:
-        click.secho(f"Internal error: Invalid Fernet key generated: {e}", **COLOR_ERROR)
+    encrypted_pek = read_pek_file()
+    if encrypted_pek is None:
         return None
 
-    # 3. Decrypt the PEK
+    # 2. Decrypt the PEK
     try:
-        pek = f.decrypt(encrypted_pek)
+        if encrypted_pek.startswith(FERNET_TOKEN_PREFIX):
+            pek = Fernet(base64.urlsafe_b64encode(derived_key)).decrypt(encrypted_pek)
+        elif encrypted_pek.startswith(PEK_FORMAT_AESGCM):
+            associated_data, _, nonce, ciphertext = parse_aesgcm_pek(encrypted_pek)
+            pek = AESGCM(derived_key).decrypt(nonce, ciphertext, associated_data)
+        else:
+            click.secho(f"Unrecognised PEK file format: {PEK_FILE}", **COLOR_ERROR)
+            sys.exit(1)
         return pek
-    except InvalidToken:
+    except (InvalidTag, InvalidToken):
         click.secho("The master password is incorrect. Please try again.", **COLOR_ERROR)
         sys.exit(1)
     except Exception as e:
         click.secho(f"Unknown decryption error: {e}", **COLOR_ERROR)
         sys.exit(1)
+
+
+def unlock_pek(salt):
+    """
+    Prompts for the current master password and uses it to decrypt the PEK.
+    Exits if the PEK cannot be decrypted.
+
+    Args:
+        salt (bytes): The salt from the salt file
+
+    Returns:
+        A tuple of (master password (str), PEK (bytes)).
+    """
+    kdf = key_derivation_function(salt=salt)
+    master_password = login()
+    kek = generate_derived_key(kdf=kdf, master_password=master_password)
+    pek = retrieve_and_decrypt_pek(derived_key=kek)
+    if pek is None:
+        sys.exit(1)
+    return master_password, pek
+
+
+def rewrap_pek(salt, master_password, pek):
+    """
+    Calibrates the configured KDF for this machine, derives a new KEK from master_password
+    and stores the PEK encrypted with it.
+
+    Args:
+        salt (bytes): The salt from the salt file
+        master_password (str): The master password to derive the new KEK from
+        pek (bytes): The PEK to encrypt
+    """
+    click.secho("Calibrating key derivation for this machine...", **COLOR_WARNING)
+    kdf_params = calibrate_kdf_params()
+    kdf = key_derivation_function(salt=salt, params=kdf_params)
+    kek = generate_derived_key(kdf=kdf, master_password=master_password)
+    encrypt_pek(derived_key=kek, pek=pek, kdf_params=kdf_params)
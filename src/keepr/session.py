@@ -5,24 +5,15 @@ import click
 from keepr.config import SESSION_FILE_NAME, SESSION_TIMEOUT_SECONDS, SECURITY_DIR_NAME, DB_DIR_NAME
 from keepr.config import COLOR_ERROR
 
-def get_session_file_path():
-    """
-    Get the session file path that holds the session data.
-    Return:
-        session_file: session file path
-    """
-    home_dir = Path.home()
-    session_file = home_dir / DB_DIR_NAME / SECURITY_DIR_NAME / SESSION_FILE_NAME
-    return session_file
+# The session file path, resolved once per process
+SESSION_FILE = Path.home() / DB_DIR_NAME / SECURITY_DIR_NAME / SESSION_FILE_NAME
 
 def store_session_data(pek):
-    session_file = get_session_file_path()
-
     try:
-        with open(session_file, "wb") as f:
+        with open(SESSION_FILE, "wb") as f:
             f.write(pek)
             f.write(int(time.time()).to_bytes(8, 'big'))
-        os.chmod(session_file, 0o600)
+        os.chmod(SESSION_FILE, 0o600)
         return True
     except Exception as e:
         click.secho(f"SESSION ERROR: Failed to store session data. Details: {e}", **COLOR_ERROR)
@@ -35,29 +26,27 @@ def retrieve_session_pek():
     Return:
         pek: primary encryption key
     """
-    session_file = get_session_file_path()
-    if not session_file.exists():
-        return None
-
     try:
-        with open(session_file, "rb") as f:
-            content = f.read()
-            if len(content) != 40:
-                return None
+        # A single read; a missing file means there is no active session
+        content = SESSION_FILE.read_bytes()
+        if len(content) != 40:
+            return None
 
-            pek = content[:32]
-            timestamp_bytes = content[32:]
-            timestamp = int.from_bytes(timestamp_bytes, "big")
+        pek = content[:32]
+        timestamp_bytes = content[32:]
+        timestamp = int.from_bytes(timestamp_bytes, "big")
 
-            if time.time() - timestamp > SESSION_TIMEOUT_SECONDS:
-                session_file.unlink()
-                return None
-            return pek
+        if time.time() - timestamp > SESSION_TIMEOUT_SECONDS:
+            SESSION_FILE.unlink()
+            return None
+        return pek
 
+    except FileNotFoundError:
+        return None
     except Exception as e:
         click.secho(f"SESSION ERROR: Failed to retrieve session data. Details: {e}", **COLOR_ERROR)
         try:
-            session_file.unlink()
+            SESSION_FILE.unlink()
         except:
             pass
         return None
@@ -66,10 +55,9 @@ def clear_session_data():
     """
     Clear the session data.
     """
-    session_file = get_session_file_path()
     try:
-        if session_file.exists():
-            session_file.unlink()
+        if SESSION_FILE.exists():
+            SESSION_FILE.unlink()
             return True
     except Exception as e:
         click.secho(f"SESSION ERROR: Failed to clear session data. Details: {e}", **COLOR_ERROR)